@@ -1,591 +1,952 @@
+import io
+import gzip
 import os
-import json
+import re
+import itertools
+import orjson
+import ijson
+import zstandard as zstd
 import time
 import requests
 import zipfile
-import shutil
 import tempfile
 import gradio as gr
-from pathlib import Path
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
 
-def backup_meilisearch(meilisearch_url, meilisearch_api_key):
-    """Backup all Meilisearch indexes to a zip file."""
-    # Ensure URL format is correct
-    if meilisearch_url.endswith('/'):
-        meilisearch_url = meilisearch_url[:-1]
+# Request headers for bodies that are serialized with orjson up front
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Request headers for document batches, sent gzip-compressed; JSON shrinks
+# several times over even at compression level 1
+GZIP_JSON_HEADERS = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+
+# Start of a documents page body, as serialized by Meilisearch
+RESULTS_PREFIX = b'{"results":['
+
+# Zstandard level for backup documents; level 3 beats DEFLATE on both speed
+# and ratio for JSON text
+ZSTD_LEVEL = 3
+
+# Version of the backup layout, recorded in every index's info.json and
+# read back on restore to pick the documents file and how to parse it.
+# 1 (or missing): documents.json holding one JSON array,
+# 2: documents.ndjson.zst with one page of documents per line, each line a JSON array
+BACKUP_FORMAT_VERSION = 2
+
+# Number of document pages fetched concurrently per index during backup;
+# raise it until Meilisearch saturates (usually somewhere around 8-16)
+PAGE_FETCH_WORKERS = max(1, int(os.environ.get("MEILI_BACKUP_WORKERS", "8")))
+
+# Number of indexes requested per page when listing indexes
+INDEX_PAGE_LIMIT = 1000
+
+# Number of concurrent settings/stats requests when a backup starts
+METADATA_WORKERS = 16
+
+# Largest number of documents requested per page during backup
+PAGE_LIMIT = int(os.environ.get("MEILI_PAGE_LIMIT", "20000"))
+
+# Content encoding asked of Meilisearch for responses. Document pages are
+# stored with Zstandard either way, so on a fast local network "identity"
+# skips the server's compression and our decompression
+ACCEPT_ENCODING = os.environ.get("MEILI_ACCEPT_ENCODING", "gzip")
+
+# Number of documents sent per batch during restore; smaller batches keep
+# each request and indexing task short
+RESTORE_BATCH_SIZE = 500
+
+# Pages that time out or are refused with 413 are split in half as long
+# as the halves hold at least this many documents
+MIN_PAGE_LIMIT = 100
+
+# Seconds to wait for a single documents page before splitting it
+PAGE_TIMEOUT = 60
+
+# Number of document batch uploads kept in flight per index during restore;
+# Meilisearch only enqueues each batch, so several can be sent at once
+UPLOAD_INFLIGHT = max(1, int(os.environ.get("MEILI_UPLOAD_INFLIGHT", "8")))
+
+# Responses with these statuses mean Meilisearch wants uploads to slow down
+THROTTLE_STATUSES = (429, 503)
+
+# Longest delay, in seconds, inserted between batch uploads
+MAX_THROTTLE = 5.0
+
+# Times a batch the server keeps pushing back on is sent again before it
+# is given up; each send already includes the session's own retries
+BATCH_RESENDS = 5
+
+# Least number of seconds between two progress updates sent to the UI
+PROGRESS_INTERVAL = 0.5
+
+# Where a rejected settings key appears in a Meilisearch error message:
+# "Unknown field `key`: expected one of ..." or "Invalid value at `.key...`"
+UNKNOWN_FIELD_RE = re.compile(r"Unknown field `([^`]+)`")
+SETTING_PATH_RE = re.compile(r"\bat `\.([A-Za-z]+)")
+
+# Indexes that need more than a plain restore, restored after all others
+# in this order with these _restore_index options
+RESTORE_PLAN = {
+    # The page index needs 'id' as its primary key
+    'page': dict(force_delete=True, force_primary_key='id'),
+    # The documents index is restored with vector search disabled
+    'documents': dict(force_delete=True, strip_embedders=True, inject_vectors_null=True),
+}
+
+class Log:
+    """Collect log lines and join them only when the text is needed."""
     
-    # Setup headers
-    headers = {"Authorization": f"Bearer {meilisearch_api_key}"}
+    def __init__(self):
+        self.parts = []
     
-    # Create temporary directory for backup
-    temp_dir = tempfile.mkdtemp()
-    output_dir = Path(temp_dir) / "meilisearch_backup"
-    output_dir.mkdir(exist_ok=True)
+    def __call__(self, message):
+        self.parts.append(f"{message}\n")
     
-    # Get list of all indexes
-    response = requests.get(f"{meilisearch_url}/indexes", headers=headers)
-    if response.status_code != 200:
-        return None, f"Failed to get indexes: {response.text}"
+    def value(self):
+        text = "".join(self.parts)
+        self.parts = [text]
+        return text
+
+class Throttle:
+    """Delay between batch uploads that adapts to server pushback.
     
-    indexes = response.json().get("results", [])
-    log_output = f"Found {len(indexes)} indexes\n"
+    The delay grows whenever an upload was answered with 429/503 (including
+    attempts the session already retried) and honours Retry-After; it decays
+    on every accepted upload, so a healthy server sees no delay at all.
+    """
     
-    # Process each index
-    for index in indexes:
-        index_uid = index["uid"]
-        log_output += f"Processing index: {index_uid}\n"
-        
-        # Create index directory
-        index_dir = output_dir / index_uid
-        index_dir.mkdir(exist_ok=True)
-        
-        # Get index settings
-        settings_response = requests.get(
-            f"{meilisearch_url}/indexes/{index_uid}/settings", 
-            headers=headers
-        )
-        if settings_response.status_code == 200:
-            settings = settings_response.json()
-            with open(index_dir / "settings.json", "w") as f:
-                json.dump(settings, f, indent=2)
-        
-        # Get total documents count
-        stats_response = requests.get(
-            f"{meilisearch_url}/indexes/{index_uid}/stats", 
-            headers=headers
+    def __init__(self):
+        self.delay = 0.0
+    
+    def observe(self, response):
+        """Adjust the delay from the response to a batch upload."""
+        retries = getattr(response.raw, "retries", None)
+        history = retries.history if retries else ()
+        if response.status_code in THROTTLE_STATUSES or any(h.status in THROTTLE_STATUSES for h in history):
+            self.delay = min(MAX_THROTTLE, max(0.1, self.delay * 2 + 0.1))
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                self.delay = max(self.delay, min(MAX_THROTTLE, float(retry_after)))
+        else:
+            self.delay = max(0.0, self.delay * 0.5 - 0.01)
+    
+    def wait(self):
+        if self.delay:
+            time.sleep(self.delay)
+
+class MeilisearchRetry(Retry):
+    """Retry policy that replays POST requests only when they were refused.
+    
+    POST /indexes is not idempotent: behind a proxy a 502/503/504 can come
+    back after Meilisearch already enqueued the request, and replaying it
+    enqueues a second task. A 429 is sent before anything is enqueued, so
+    that is the only status POSTs are retried on.
+    
+    Read timeouts are never retried: only document pages are fetched with a
+    timeout, and a page that timed out once is split rather than re-sent.
+    """
+    
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == "POST" and status_code != 429:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+    
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if isinstance(error, ReadTimeoutError):
+            raise error  # Surfaces as requests' ReadTimeout
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+def create_session(meilisearch_api_key):
+    """Create a pooled HTTP session authenticated against Meilisearch."""
+    # PATCH requests only replace settings, so they are safe to retry; POSTs
+    # are retried on 429 only, which lets the server push back on uploads
+    retry = MeilisearchRetry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[429, 502, 503, 504],
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"POST", "PATCH"},
+        # Hand the last 429/5xx back instead of raising, so callers see it
+        raise_on_status=False
+    )
+    # Enough pooled connections for every page worker, metadata request and
+    # upload in flight
+    pool_maxsize = max(32, PAGE_FETCH_WORKERS, METADATA_WORKERS, UPLOAD_INFLIGHT)
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_maxsize, max_retries=retry)
+    
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({
+        "Authorization": f"Bearer {meilisearch_api_key}",
+        "Accept-Encoding": ACCEPT_ENCODING
+    })
+    return session
+
+@lru_cache(maxsize=8)
+def get_session(meilisearch_api_key):
+    """Return the pooled session for an API key, shared by every backup and restore.
+    
+    Keeping the session between runs keeps its connections alive, so a new
+    run does not pay the TCP/TLS handshakes again.
+    """
+    return create_session(meilisearch_api_key)
+
+def fetch_documents_page(session, meilisearch_url, index_uid, offset, limit):
+    """Fetch one page of documents from an index.
+    
+    Returns (documents, count, error) where documents is the page's results
+    array as a single NDJSON line, ready to be appended to the backup. The
+    array is copied out of the response body without decoding it whenever
+    the body has the layout Meilisearch serializes.
+    """
+    try:
+        response = session.get(
+            f"{meilisearch_url}/indexes/{index_uid}/documents",
+            params={"offset": offset, "limit": limit},
+            timeout=PAGE_TIMEOUT
         )
-        
-        total_docs = 0
-        if stats_response.status_code == 200:
-            stats = stats_response.json()
-            total_docs = stats.get("numberOfDocuments", 0)
-            log_output += f"Index {index_uid} has {total_docs} documents total\n"
-        
-        # Get documents (paginated)
-        offset = 0
-        limit = 1000
-        all_documents = []
-        
+    except requests.exceptions.ReadTimeout:
+        # Only a page that was too slow to serve is split; connect timeouts
+        # mean the server is unreachable and fail like any other error
+        response = None
+    except requests.exceptions.RequestException as e:
+        return None, 0, f"Failed to get documents at offset {offset}: {str(e)}"
+    
+    # Page too large for the server to answer: fetch it as two halves instead
+    if (response is None or response.status_code == 413) and limit // 2 >= MIN_PAGE_LIMIT:
+        half = limit // 2
+        first, first_count, error = fetch_documents_page(session, meilisearch_url, index_uid, offset, half)
+        if error or first_count < half:
+            return first, first_count, error
+        second, second_count, error = fetch_documents_page(session, meilisearch_url, index_uid, offset + half, limit - half)
+        if error:
+            return None, 0, error
+        return first + second, first_count + second_count, None
+    
+    if response is None:
+        return None, 0, f"Timed out fetching documents at offset {offset} with limit {limit}"
+    if response.status_code != 200:
+        return None, 0, f"Failed to get documents: {response.text}"
+    
+    body = response.content
+    if body.startswith(RESULTS_PREFIX):
+        # Meilisearch serializes the results first and only numbers after
+        # them, so the last ']' closes the results array and what follows
+        # is the page metadata we need to count the documents
+        end = body.rfind(b"]")
+        try:
+            page = orjson.loads(b"{" + body[end + 2:])
+            count = max(0, min(page["limit"], page["total"] - page["offset"]))
+            documents = body[len(RESULTS_PREFIX) - 1:end + 1]
+            # Compact JSON has no raw newlines; anything else is re-encoded,
+            # and so is a page whose count disagrees with an empty array
+            if b"\n" not in documents and (count == 0) == (documents == b"[]"):
+                return documents + b"\n", count, None
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            pass  # Not the layout we expected, decode the whole page instead
+    
+    # Check if the response is in the expected format
+    try:
+        documents = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return None, 0, f"Failed to parse JSON response: {response.text[:200]}..."
+    
+    # Newer Meilisearch versions wrap the page in a results field
+    if isinstance(documents, dict) and "results" in documents:
+        documents = documents["results"]
+    elif not isinstance(documents, list):
+        return None, 0, f"Unexpected response format: {type(documents)}, sample of response: {str(documents)[:200]}..."
+    
+    return orjson.dumps(documents, option=orjson.OPT_APPEND_NEWLINE), len(documents), None
+
+def page_limit_for(total_docs, page_limit=PAGE_LIMIT):
+    """Pick the page size for an index from its document count.
+    
+    Indexes that fit in a single round of concurrent requests are split
+    evenly across the page fetch workers; larger ones use page_limit.
+    """
+    if not total_docs:
+        return page_limit
+    return max(min(1000, page_limit), min(page_limit, -(-total_docs // PAGE_FETCH_WORKERS)))
+
+def iter_document_pages(session, meilisearch_url, index_uid, total_docs, limit):
+    """Yield (offset, documents, count, error) for every page of an index, in order.
+    
+    With the document count from the index stats, exactly the pages covering
+    it are fetched, concurrently, keeping at most PAGE_FETCH_WORKERS requests
+    in flight. When total_docs is None (stats unavailable) pages are fetched
+    one at a time until a short page comes back.
+    
+    Pages are addressed by offset on purpose. Keyset pagination on the
+    primary key would need the key to be filterable, and changing that
+    setting reindexes the source index. The documents routes cannot sort,
+    and search results are capped by maxTotalHits and filtered through
+    displayedAttributes, so search can't replace them either. Large pages
+    (see page_limit_for) keep the number of deep offsets small instead.
+    """
+    pending = deque()
+    next_offset = 0
+    with ThreadPoolExecutor(max_workers=PAGE_FETCH_WORKERS) as executor:
         while True:
-            log_output += f"Fetching documents from {index_uid}: offset={offset}, limit={limit}\n"
-            docs_response = requests.get(
-                f"{meilisearch_url}/indexes/{index_uid}/documents",
-                params={"offset": offset, "limit": limit},
-                headers=headers
-            )
-            
-            if docs_response.status_code != 200:
-                log_output += f"Failed to get documents: {docs_response.text}\n"
-                break
+            while total_docs is not None and next_offset < total_docs and len(pending) < PAGE_FETCH_WORKERS:
+                future = executor.submit(fetch_documents_page, session, meilisearch_url, index_uid, next_offset, limit)
+                pending.append((next_offset, future))
+                next_offset += limit
             
-            # Check if the response is in the expected format
-            try:
-                documents = docs_response.json()
-                # Check if we got a proper response with results field
-                if isinstance(documents, dict) and "results" in documents:
-                    documents = documents["results"]
-                    log_output += f"Retrieved {len(documents)} documents (using 'results' field)\n"
-                elif not isinstance(documents, list):
-                    log_output += f"Unexpected response format: {type(documents)}\n"
-                    log_output += f"Sample of response: {str(documents)[:200]}...\n"
-                    break
-            except json.JSONDecodeError:
-                log_output += f"Failed to parse JSON response: {docs_response.text[:200]}...\n"
-                break
-            
-            if not documents:
-                log_output += "No more documents to retrieve\n"
-                break
-            
-            all_documents.extend(documents)
-            log_output += f"Retrieved {len(documents)} documents from index {index_uid}, total so far: {len(all_documents)}\n"
+            if pending:
+                offset, future = pending.popleft()
+                documents, count, error = future.result()
+            elif total_docs is None:
+                offset = next_offset
+                documents, count, error = fetch_documents_page(session, meilisearch_url, index_uid, offset, limit)
+                next_offset += limit
+            else:
+                return
             
-            if len(documents) < limit:
-                break
+            yield offset, documents, count, error
             
-            offset += limit
-        
-        # Save documents
-        log_output += f"Saving {len(all_documents)} documents for index {index_uid}\n"
-        with open(index_dir / "documents.json", "w") as f:
-            json.dump(all_documents, f, indent=2)
-        
-        # Save index metadata
-        with open(index_dir / "info.json", "w") as f:
-            json.dump(index, f, indent=2)
-    
-    # Create zip file
-    zip_path = os.path.join(temp_dir, "meilisearch_backup.zip")
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(output_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, temp_dir)
-                zipf.write(file_path, arcname)
-    
-    log_output += f"Backup completed successfully. Zip file created at {zip_path}\n"
-    
-    return zip_path, log_output
+            if error or not count or (total_docs is None and count < limit):
+                return
 
-def wait_for_task(meilisearch_url, task_id, headers):
-    """Wait for a Meilisearch task to complete."""
+def list_indexes(session, meilisearch_url):
+    """Fetch every index of the instance, following /indexes pagination.
+    
+    Returns (indexes, error).
+    """
+    indexes = []
     while True:
-        response = requests.get(f"{meilisearch_url}/tasks/{task_id}", headers=headers)
-        if response.status_code == 200:
-            task = response.json()
-            if task['status'] in ['succeeded', 'failed', 'canceled']:
-                return task
-        else:
-            return None
+        response = session.get(
+            f"{meilisearch_url}/indexes",
+            params={"offset": len(indexes), "limit": INDEX_PAGE_LIMIT}
+        )
+        if response.status_code != 200:
+            return None, f"Failed to get indexes: {response.text}"
         
-        time.sleep(0.5)  # Wait before checking again
+        page = orjson.loads(response.content)
+        results = page.get("results", [])
+        indexes.extend(results)
+        if not results or len(indexes) >= page.get("total", 0):
+            return indexes, None
+
+def fetch_index_metadata(session, meilisearch_url, index_uids):
+    """Fetch the settings and stats responses of every index concurrently.
+    
+    Returns {index_uid: (settings_response, stats_response)}.
+    """
+    with ThreadPoolExecutor(max_workers=METADATA_WORKERS) as executor:
+        settings_responses = executor.map(
+            lambda index_uid: session.get(f"{meilisearch_url}/indexes/{index_uid}/settings"), index_uids
+        )
+        stats_responses = executor.map(
+            lambda index_uid: session.get(f"{meilisearch_url}/indexes/{index_uid}/stats"), index_uids
+        )
+        return dict(zip(index_uids, zip(settings_responses, stats_responses)))
 
-def restore_meilisearch(meilisearch_url, meilisearch_api_key, zip_file):
-    """Restore Meilisearch indexes from a zip file."""
+def backup_meilisearch(meilisearch_url, meilisearch_api_key, page_limit=PAGE_LIMIT):
+    """Backup all Meilisearch indexes to a zip file.
+    
+    page_limit is the largest number of documents requested per page.
+    Yields (zip_path, log) as the backup progresses; zip_path is None until
+    the zip file is complete. The log is only joined by log.value() when
+    the caller actually shows it.
+    """
+    log = Log()
+    
     # Ensure URL format is correct
     if meilisearch_url.endswith('/'):
         meilisearch_url = meilisearch_url[:-1]
     
-    # Setup headers
-    headers = {"Authorization": f"Bearer {meilisearch_api_key}", "Content-Type": "application/json"}
+    # Reuse the pooled session of this API key so connections stay warm
+    session = get_session(meilisearch_api_key)
     
-    # Create temporary directory for extraction
-    temp_dir = tempfile.mkdtemp()
+    # Get list of all indexes
+    indexes, error = list_indexes(session, meilisearch_url)
+    if error:
+        log(error)
+        yield None, log
+        return
     
-    # Extract zip file
-    log_output = f"Extracting backup from {zip_file} to {temp_dir}\n"
-    with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-        zip_ref.extractall(temp_dir)
+    log(f"Found {len(indexes)} indexes")
+    yield None, log
     
-    # Find the backup directory
-    backup_dir = None
-    for item in os.listdir(temp_dir):
-        if os.path.isdir(os.path.join(temp_dir, item)) and "meilisearch_backup" in item:
-            backup_dir = Path(os.path.join(temp_dir, item))
-            break
+    # Settings and stats of all indexes are fetched up front, concurrently
+    metadata = fetch_index_metadata(session, meilisearch_url, [index["uid"] for index in indexes])
     
-    if not backup_dir:
-        return "Error: Could not find meilisearch_backup directory in the zip file."
+    # Write the backup straight into the zip file, no intermediate files
+    temp_dir = tempfile.mkdtemp()
+    zip_path = os.path.join(temp_dir, "meilisearch_backup.zip")
+    compressor = zstd.ZstdCompressor(level=ZSTD_LEVEL, threads=-1)
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zipf:
+        # Process each index
+        for index in indexes:
+            index_uid = index["uid"]
+            index_dir = f"meilisearch_backup/{index_uid}"
+            log(f"Processing index: {index_uid}")
+            
+            settings_response, stats_response = metadata[index_uid]
+            
+            # Save index settings
+            if settings_response.status_code == 200:
+                zipf.writestr(f"{index_dir}/settings.json", settings_response.content)
+            
+            # Get total documents count
+            total_docs = None
+            if stats_response.status_code == 200:
+                stats = orjson.loads(stats_response.content)
+                total_docs = stats.get("numberOfDocuments", 0)
+                log(f"Index {index_uid} has {total_docs} documents total")
+            
+            # Stream documents into the zip page by page (several pages in flight at once)
+            limit = page_limit_for(total_docs, page_limit)
+            saved_docs = 0
+            
+            # Documents are Zstandard-compressed as they are written, so the
+            # zip entry itself is stored rather than deflated a second time
+            documents_info = zipfile.ZipInfo(f"{index_dir}/documents.ndjson.zst", date_time=time.localtime()[:6])
+            documents_info.compress_type = zipfile.ZIP_STORED
+            
+            with zipf.open(documents_info, "w", force_zip64=True) as entry, \
+                    compressor.stream_writer(entry, closefd=False) as f:
+                for offset, documents, count, error in iter_document_pages(session, meilisearch_url, index_uid, total_docs, limit):
+                    if error:
+                        log(error)
+                        break
+                    
+                    if not count or not documents:
+                        log("No more documents to retrieve")
+                        break
+                    
+                    f.write(documents)
+                    saved_docs += count
+                    log(f"Saved {count} documents from index {index_uid} at offset {offset}, total so far: {saved_docs}")
+                    yield None, log
+            
+            # Save index metadata
+            zipf.writestr(f"{index_dir}/info.json", orjson.dumps({**index, "backupFormatVersion": BACKUP_FORMAT_VERSION}))
     
-    # Get all index directories
-    index_dirs = [d for d in backup_dir.iterdir() if d.is_dir()]
-    log_output += f"Found {len(index_dirs)} indexes to restore\n"
+    log(f"Backup completed successfully. Zip file created at {zip_path}")
     
-    # First restore regular indexes
-    for index_dir in index_dirs:
-        index_uid = index_dir.name
-        log_output += f"Restoring index: {index_uid}\n"
+    yield zip_path, log
+
+def find_documents_file(names, index_dir, format_version):
+    """Return the zip member holding the documents of an index backup, if any."""
+    name = "documents.ndjson.zst" if format_version >= 2 else "documents.json"
+    documents_file = f"{index_dir}/{name}"
+    return documents_file if documents_file in names else None
+
+def iter_document_batches(zip_ref, documents_file, batch_size, format_version):
+    """Stream documents from a backup zip member in batches of at most batch_size."""
+    with zip_ref.open(documents_file) as f:
+        # Version 2: zstd compressed, every line is one backed-up page, a JSON array of documents
+        if format_version >= 2:
+            f = zstd.ZstdDecompressor().stream_reader(f)
+            pages = map(orjson.loads, io.BufferedReader(f))
+            documents = itertools.chain.from_iterable(pages)
+            while True:
+                batch = list(itertools.islice(documents, batch_size))
+                if not batch:
+                    return
+                yield batch
         
-        # Skip documents index as it will be handled separately
-        if index_uid == 'documents':
-            log_output += f"Skipping 'documents' index as it will be handled separately\n"
-            continue
+        # Version 1 backups hold a single JSON array
+        batch = []
+        for doc in ijson.items(f, "item", use_float=True):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def _task_uid(response):
+    """Extract the taskUid from the small JSON body of a Meilisearch write response."""
+    return orjson.loads(response.content).get('taskUid')
+
+def wait_for_tasks(meilisearch_url, task_ids, session, first_completed=False):
+    """Wait for several Meilisearch tasks to complete. Returns {task_id: task}.
+    
+    All pending tasks are polled with a single /tasks query, backing off
+    exponentially from 50 ms up to 1 s between polls. With first_completed
+    it returns as soon as any of them has finished. Tasks that cannot be
+    polled are left out of the result.
+    """
+    pending = {task_id for task_id in task_ids if task_id is not None}
+    finished = {}
+    delay = 0.05
+    
+    while pending:
+        response = session.get(
+            f"{meilisearch_url}/tasks",
+            params={"uids": ",".join(map(str, sorted(pending))), "limit": len(pending)}
+        )
+        if response.status_code != 200:
+            break
         
-        # Special case handling for 'page' index
-        requires_special_handling = index_uid == 'page'
+        found = set()
+        for task in orjson.loads(response.content).get("results", []):
+            found.add(task['uid'])
+            if task['status'] in ['succeeded', 'failed', 'canceled']:
+                finished[task['uid']] = task
+        pending &= found  # Unknown task IDs will never finish
+        pending -= finished.keys()
         
-        # Check if index already exists
-        check_response = requests.get(f"{meilisearch_url}/indexes/{index_uid}", headers=headers)
+        if first_completed and finished:
+            break
+        if pending:
+            time.sleep(delay)  # Wait before checking again
+            delay = min(1.0, delay * 1.5)
+    
+    return finished
+
+def wait_for_task(meilisearch_url, task_id, session):
+    """Wait for a Meilisearch task to complete."""
+    return wait_for_tasks(meilisearch_url, [task_id], session).get(task_id)
+
+def with_primary_key(batches, primary_key):
+    """Make sure every document carries the primary_key field."""
+    for batch in batches:
+        for doc in batch:
+            if '_meilisearch_id' in doc and primary_key not in doc:
+                doc[primary_key] = doc['_meilisearch_id']  # Copy value to ensure the key exists
+        yield batch
+
+def with_null_vectors(batches):
+    """Add _vectors.default: null to documents that have no vectors."""
+    for batch in batches:
+        for doc in batch:
+            if '_vectors' not in doc:
+                doc['_vectors'] = {'default': None}
+        yield batch
+
+def post_documents(session, meilisearch_url, index_uid, batch):
+    """Add a batch of documents to an index, sent as gzip-compressed JSON."""
+    return session.post(
+        f"{meilisearch_url}/indexes/{index_uid}/documents",
+        data=gzip.compress(orjson.dumps(batch), compresslevel=1),
+        headers=GZIP_JSON_HEADERS
+    )
+
+def upload_document_batches(session, meilisearch_url, index_uid, batches, log, primary_key_fallback=None):
+    """Add batches of documents to an index, keeping several uploads in flight.
+    
+    Up to UPLOAD_INFLIGHT batches are posted or being indexed at any time.
+    When the window is full, the tasks of every batch in it are polled with
+    a single /tasks query and the slots of the finished ones go to the next
+    batches, so Meilisearch always has queued work while they are read.
+    Submissions are paced by a Throttle when the server pushes back, and a
+    batch refused with 429/503 is sent again up to BATCH_RESENDS times.
+    If primary_key_fallback is set and a batch fails on a primary key error,
+    the index primary key is switched to it and the batch is sent once more.
+    Yields the log whenever slots are freed and returns the number of
+    documents sent.
+    """
+    added_docs = 0
+    posted = deque()  # (batch, future, resends) waiting for the upload response
+    enqueued = {}  # task_id -> batch being indexed
+    throttle = Throttle()
+    
+    with ThreadPoolExecutor(max_workers=UPLOAD_INFLIGHT) as executor:
+        def submit(batch, resends=0):
+            throttle.wait()
+            future = executor.submit(post_documents, session, meilisearch_url, index_uid, batch)
+            posted.append((batch, future, resends))
         
-        # If special handling is needed and index exists, delete it first
-        if requires_special_handling and check_response.status_code == 200:
-            log_output += f"Special handling for index {index_uid}: deleting existing index\n"
-            delete_response = requests.delete(f"{meilisearch_url}/indexes/{index_uid}", headers=headers)
+        def free_slots():
+            # Uploads are only enqueued by Meilisearch, so their responses come quickly
+            while posted:
+                batch, future, resends = posted.popleft()
+                task_id, pushed_back = enqueue_document_batch(index_uid, future, log, throttle)
+                if pushed_back and resends < BATCH_RESENDS:
+                    submit(batch, resends + 1)
+                elif pushed_back:
+                    log(f"Giving up on a batch of {len(batch)} documents for index {index_uid} after {resends} resends")
+                elif task_id is not None:
+                    enqueued[task_id] = batch
             
-            if delete_response.status_code in (200, 202):
-                task_id = delete_response.json().get('taskUid')
-                log_output += f"Index deletion enqueued with task ID {task_id}, waiting for completion...\n"
-                
-                task = wait_for_task(meilisearch_url, task_id, headers)
-                if task and task['status'] == 'succeeded':
-                    log_output += f"Deleted index {index_uid}\n"
-                else:
-                    log_output += f"Failed to delete index {index_uid}: {task}\n"
-                    continue
-            else:
-                log_output += f"Failed to delete index {index_uid}: {delete_response.text}\n"
-                continue
-            
-            # Reset check_response to indicate index no longer exists
-            check_response.status_code = 404
-        
-        # Create index if it doesn't exist
-        if check_response.status_code == 404:
-            # Get index info from backup
-            info_file = index_dir / "info.json"
-            if info_file.exists():
-                with open(info_file, "r") as f:
-                    info = json.load(f)
-                
-                # Create index with primary key if specified
-                primary_key = info.get("primaryKey")
-                create_data = {"uid": index_uid}
-                
-                # For special case indexes, ensure primary key is set
-                if index_uid == 'page' and not primary_key:
-                    primary_key = 'id'  # Force 'id' as primary key for page index
-                
-                if primary_key:
-                    create_data["primaryKey"] = primary_key
-                
-                create_response = requests.post(
-                    f"{meilisearch_url}/indexes",
-                    headers=headers,
-                    json=create_data
-                )
-                
-                if create_response.status_code in (201, 200, 202):
-                    # Get task ID from response and wait for completion
-                    task_id = create_response.json().get('taskUid')
-                    log_output += f"Index creation enqueued with task ID {task_id}, waiting for completion...\n"
-                    
-                    task = wait_for_task(meilisearch_url, task_id, headers)
-                    if task and task['status'] == 'succeeded':
-                        log_output += f"Created index {index_uid}\n"
-                    else:
-                        log_output += f"Failed to create index {index_uid}: {task}\n"
-                        continue
-                else:
-                    log_output += f"Failed to create index {index_uid}: {create_response.text}\n"
-                    continue
-            else:
-                # Create index without info
-                create_data = {"uid": index_uid}
-                
-                # For special case indexes, ensure primary key is set
-                if index_uid == 'page':
-                    create_data["primaryKey"] = 'id'  # Force 'id' as primary key for page index
-                
-                create_response = requests.post(
-                    f"{meilisearch_url}/indexes",
-                    headers=headers,
-                    json=create_data
-                )
-                
-                if create_response.status_code in (201, 200, 202):
-                    # Get task ID from response and wait for completion
-                    task_id = create_response.json().get('taskUid')
-                    log_output += f"Index creation enqueued with task ID {task_id}, waiting for completion...\n"
-                    
-                    task = wait_for_task(meilisearch_url, task_id, headers)
-                    if task and task['status'] == 'succeeded':
-                        log_output += f"Created index {index_uid}\n"
-                    else:
-                        log_output += f"Failed to create index {index_uid}: {task}\n"
-                        continue
-                else:
-                    log_output += f"Failed to create index {index_uid}: {create_response.text}\n"
-                    continue
-        else:
-            log_output += f"Index {index_uid} already exists\n"
+            if not enqueued:
+                return
+            finished = wait_for_tasks(meilisearch_url, list(enqueued), session, first_completed=True)
+            if not finished:
+                log(f"Could not follow document tasks {', '.join(map(str, enqueued))} of index {index_uid}")
+                enqueued.clear()
+            for task_id, task in finished.items():
+                batch = enqueued.pop(task_id)
+                finish_document_task(session, meilisearch_url, index_uid, batch, task, log, primary_key_fallback)
         
-        # Restore settings
-        settings_file = index_dir / "settings.json"
-        if settings_file.exists():
-            try:
-                with open(settings_file, "r") as f:
-                    settings = json.load(f)
-                
-                # Apply all settings at once
-                all_settings_response = requests.patch(
-                    f"{meilisearch_url}/indexes/{index_uid}/settings",
-                    headers=headers,
-                    json=settings
-                )
+        try:
+            for batch in batches:
+                while len(posted) + len(enqueued) >= UPLOAD_INFLIGHT:
+                    free_slots()
+                    yield log
                 
-                if all_settings_response.status_code in (200, 202):
-                    # Wait for task to complete
-                    task_id = all_settings_response.json().get('taskUid')
-                    if task_id is not None:
-                        log_output += f"Settings update enqueued with task ID {task_id}, waiting for completion...\n"
-                        task = wait_for_task(meilisearch_url, task_id, headers)
-                        if task and task['status'] == 'succeeded':
-                            log_output += f"Applied all settings to index {index_uid}\n"
-                        else:
-                            log_output += f"Failed to apply all settings to index {index_uid}: {task}\n"
-                    else:
-                        log_output += f"Applied settings to index {index_uid} but no task ID was returned\n"
-                else:
-                    log_output += f"Failed to apply all settings at once: {all_settings_response.text}\n"
-                    log_output += "Trying to apply settings individually...\n"
-                    
-                    # Apply each setting type individually as fallback
-                    setting_types = [
-                        "displayedAttributes", 
-                        "filterableAttributes",
-                        "sortableAttributes", 
-                        "rankingRules", 
-                        "stopWords",
-                        "synonyms", 
-                        "distinctAttribute"
-                    ]
-                    
-                    for setting_type in setting_types:
-                        if setting_type in settings and settings[setting_type]:  # Only update if there's a value
-                            setting_value = settings[setting_type]
-                            try:
-                                settings_response = requests.put(
-                                    f"{meilisearch_url}/indexes/{index_uid}/settings/{setting_type}",
-                                    headers=headers,
-                                    json=setting_value
-                                )
-                                
-                                if settings_response.status_code in (200, 202):
-                                    task_id = settings_response.json().get('taskUid')
-                                    if task_id is not None:
-                                        log_output += f"Setting {setting_type} update enqueued with task ID {task_id}, waiting for completion...\n"
-                                        task = wait_for_task(meilisearch_url, task_id, headers)
-                                        if task and task['status'] == 'succeeded':
-                                            log_output += f"Applied setting {setting_type} to index {index_uid}\n"
-                                        else:
-                                            log_output += f"Failed to apply setting {setting_type} to index {index_uid}: {task}\n"
-                                    else:
-                                        log_output += f"Applied setting {setting_type} to index {index_uid} but no task ID was returned\n"
-                                else:
-                                    log_output += f"Failed to apply setting {setting_type} to index {index_uid}: {settings_response.text}\n"
-                            except Exception as e:
-                                log_output += f"Error applying setting {setting_type}: {str(e)}\n"
-            except Exception as e:
-                log_output += f"Error processing settings file: {str(e)}\n"
+                log(f"Adding batch of {len(batch)} documents to index {index_uid} ({added_docs+1}-{added_docs+len(batch)})")
+                added_docs += len(batch)
+                submit(batch)
+        except Exception as e:
+            log(f"Error reading documents: {str(e)}")
         
-        # Restore documents
-        documents_file = index_dir / "documents.json"
-        if documents_file.exists():
-            try:
-                with open(documents_file, "r") as f:
-                    documents = json.load(f)
-                
-                if documents:
-                    # For page index, make sure we're using the correct primary key
-                    if index_uid == 'page':
-                        log_output += "Special handling for page index documents - ensuring primary key field\n"
-                        for doc in documents:
-                            if '_meilisearch_id' in doc and 'id' not in doc:
-                                doc['id'] = doc['_meilisearch_id']  # Copy value to ensure 'id' exists
-                    
-                    # Add documents in batches to avoid timeouts
-                    batch_size = 1000
-                    for i in range(0, len(documents), batch_size):
-                        batch = documents[i:i + batch_size]
-                        log_output += f"Adding batch of {len(batch)} documents to index {index_uid} ({i+1}-{i+len(batch)} of {len(documents)})\n"
-                        
-                        try:
-                            docs_response = requests.post(
-                                f"{meilisearch_url}/indexes/{index_uid}/documents",
-                                headers=headers,
-                                json=batch
-                            )
-                            
-                            if docs_response.status_code in (202, 201, 200):
-                                # Wait for documents addition to complete
-                                task_id = docs_response.json().get('taskUid')
-                                if task_id is not None:
-                                    log_output += f"Document addition enqueued with task ID {task_id}, waiting for completion...\n"
-                                    
-                                    task = wait_for_task(meilisearch_url, task_id, headers)
-                                    if task and task['status'] == 'succeeded':
-                                        log_output += f"Successfully added batch to index {index_uid}\n"
-                                    else:
-                                        log_output += f"Failed to add documents to index {index_uid}: {task}\n"
-                                        
-                                        # Special handling for page index if the error is about primary key
-                                        if index_uid == 'page' and task and 'error' in task and 'primary_key' in str(task['error']):
-                                            log_output += "Attempting to update page index with forced primary key...\n"
-                                            # Update index with forced primary key
-                                            update_response = requests.patch(
-                                                f"{meilisearch_url}/indexes/{index_uid}",
-                                                headers=headers,
-                                                json={"primaryKey": "id"}
-                                            )
-                                            
-                                            if update_response.status_code in (200, 202):
-                                                task_id = update_response.json().get('taskUid')
-                                                log_output += f"Index update enqueued with task ID {task_id}, waiting for completion...\n"
-                                                update_task = wait_for_task(meilisearch_url, task_id, headers)
-                                                
-                                                if update_task and update_task['status'] == 'succeeded':
-                                                    log_output += f"Updated index {index_uid} with primary key 'id'\n"
-                                                    # Try adding documents again
-                                                    log_output += "Trying to add documents again...\n"
-                                                    
-                                                    docs_response = requests.post(
-                                                        f"{meilisearch_url}/indexes/{index_uid}/documents",
-                                                        headers=headers,
-                                                        json=batch
-                                                    )
-                                                    
-                                                    if docs_response.status_code in (202, 201, 200):
-                                                        task_id = docs_response.json().get('taskUid')
-                                                        log_output += f"Document addition enqueued with task ID {task_id}, waiting for completion...\n"
-                                                        
-                                                        retry_task = wait_for_task(meilisearch_url, task_id, headers)
-                                                        if retry_task and retry_task['status'] == 'succeeded':
-                                                            log_output += f"Successfully added batch to index {index_uid} on retry\n"
-                                                        else:
-                                                            log_output += f"Failed to add documents to index {index_uid} on retry: {retry_task}\n"
-                                                else:
-                                                    log_output += f"Failed to update index {index_uid}: {update_task}\n"
-                                else:
-                                    log_output += f"Documents added to index {index_uid} but no task ID was returned\n"
-                            else:
-                                log_output += f"Failed to add documents to index {index_uid}: {docs_response.text}\n"
-                        except Exception as e:
-                            log_output += f"Error adding documents batch: {str(e)}\n"
-                        
-                        # Wait a bit to avoid overwhelming the server
-                        time.sleep(1)
-                else:
-                    log_output += f"No documents found for index {index_uid}\n"
-            except Exception as e:
-                log_output += f"Error processing documents file: {str(e)}\n"
-    
-    log_output += "Regular indexes restore completed\n"
-    
-    # Fix documents index
-    documents_index_dir = backup_dir / "documents"
-    if documents_index_dir.exists():
-        log_output += "Fixing documents index specifically\n"
-        index_uid = "documents"
+        while posted or enqueued:
+            free_slots()
+            yield log
+    
+    return added_docs
+
+def enqueue_document_batch(index_uid, future, log, throttle):
+    """Read the response to a batch upload.
+    
+    Returns (task_id, pushed_back): task_id is the enqueued task, or None if
+    the upload failed, and pushed_back is True when the server refused the
+    batch with 429/503 and it should be sent again.
+    """
+    try:
+        docs_response = future.result()
+        throttle.observe(docs_response)
+        if docs_response.status_code in THROTTLE_STATUSES:
+            log(f"Meilisearch pushed back on a batch for index {index_uid} ({docs_response.status_code}), sending it again")
+            return None, True
+        if docs_response.status_code not in (202, 201, 200):
+            log(f"Failed to add documents to index {index_uid}: {docs_response.text}")
+            return None, False
         
-        # Delete the existing index if it exists
-        check_response = requests.get(f"{meilisearch_url}/indexes/{index_uid}", headers=headers)
-        if check_response.status_code == 200:
-            log_output += f"Deleting existing index {index_uid}\n"
-            delete_response = requests.delete(f"{meilisearch_url}/indexes/{index_uid}", headers=headers)
-            
-            if delete_response.status_code in (200, 202):
-                task_id = delete_response.json().get('taskUid')
-                log_output += f"Index deletion enqueued with task ID {task_id}, waiting for completion...\n"
-                
-                task = wait_for_task(meilisearch_url, task_id, headers)
-                if task and task['status'] == 'succeeded':
-                    log_output += f"Deleted index {index_uid}\n"
-                else:
-                    log_output += f"Failed to delete index {index_uid}: {task}\n"
-                    return log_output
-            else:
-                log_output += f"Failed to delete index {index_uid}: {delete_response.text}\n"
-                return log_output
+        task_id = _task_uid(docs_response)
+        if task_id is None:
+            log(f"Documents added to index {index_uid} but no task ID was returned")
+        else:
+            log(f"Document addition enqueued with task ID {task_id}")
+        return task_id, False
+    except Exception as e:
+        log(f"Error adding documents batch: {str(e)}")
+        return None, False
+
+def finish_document_task(session, meilisearch_url, index_uid, batch, task, log, primary_key_fallback=None):
+    """Log the outcome of a finished document addition task."""
+    if task['status'] == 'succeeded':
+        log(f"Successfully added batch to index {index_uid}")
+        return
+    
+    log(f"Failed to add documents to index {index_uid}: {task}")
+    
+    # Retry with a forced primary key if the error is about the primary key
+    if primary_key_fallback and 'error' in task and 'primary_key' in str(task['error']):
+        try:
+            retry_with_primary_key(session, meilisearch_url, index_uid, batch, primary_key_fallback, log)
+        except Exception as e:
+            log(f"Error adding documents batch: {str(e)}")
+
+def retry_with_primary_key(session, meilisearch_url, index_uid, batch, primary_key, log):
+    """Force the primary key of an index and add a batch again."""
+    log(f"Attempting to update {index_uid} index with forced primary key...")
+    update_response = session.patch(
+        f"{meilisearch_url}/indexes/{index_uid}",
+        data=orjson.dumps({"primaryKey": primary_key}),
+        headers=JSON_HEADERS
+    )
+    
+    if update_response.status_code not in (200, 202):
+        log(f"Failed to update index {index_uid}: {update_response.text}")
+        return
+    
+    task_id = _task_uid(update_response)
+    log(f"Index update enqueued with task ID {task_id}, waiting for completion...")
+    update_task = wait_for_task(meilisearch_url, task_id, session)
+    
+    if not update_task or update_task['status'] != 'succeeded':
+        log(f"Failed to update index {index_uid}: {update_task}")
+        return
+    
+    log(f"Updated index {index_uid} with primary key '{primary_key}'")
+    # Try adding documents again
+    log("Trying to add documents again...")
+    
+    docs_response = post_documents(session, meilisearch_url, index_uid, batch)
+    
+    if docs_response.status_code in (202, 201, 200):
+        task_id = _task_uid(docs_response)
+        log(f"Document addition enqueued with task ID {task_id}, waiting for completion...")
         
-        # Get index info from backup
-        info_file = documents_index_dir / "info.json"
-        primary_key = None
-        if info_file.exists():
-            with open(info_file, "r") as f:
-                info = json.load(f)
-                primary_key = info.get("primaryKey")
+        retry_task = wait_for_task(meilisearch_url, task_id, session)
+        if retry_task and retry_task['status'] == 'succeeded':
+            log(f"Successfully added batch to index {index_uid} on retry")
+        else:
+            log(f"Failed to add documents to index {index_uid} on retry: {retry_task}")
+
+def patch_settings(session, meilisearch_url, index_uid, settings, log):
+    """Update the settings of an index and wait for the task.
+    
+    Returns None on success, otherwise the Meilisearch error object.
+    """
+    response = session.patch(
+        f"{meilisearch_url}/indexes/{index_uid}/settings",
+        data=orjson.dumps(settings),
+        headers=JSON_HEADERS
+    )
+    
+    if response.status_code not in (200, 202):
+        try:
+            return orjson.loads(response.content)
+        except orjson.JSONDecodeError:
+            return {"message": response.text}
+    
+    task_id = _task_uid(response)
+    if task_id is None:
+        log(f"Applied settings to index {index_uid} but no task ID was returned")
+        return None
+    
+    log(f"Settings update enqueued with task ID {task_id}, waiting for completion...")
+    task = wait_for_task(meilisearch_url, task_id, session)
+    if task and task['status'] == 'succeeded':
+        return None
+    return (task or {}).get('error') or {"message": str(task)}
+
+def rejected_setting(error, settings):
+    """Return the settings key a Meilisearch error points at, if it names one.
+    
+    Only the leading position of the error is trusted: the field after
+    "Unknown field", the path in "at `.key`" or an invalid_settings_* code.
+    Keys listed later in the message, such as the "expected one of" list,
+    are ignored. None is returned when the error is ambiguous.
+    """
+    message = str(error.get("message", ""))
+    code = str(error.get("code", ""))
+    candidates = set()
+    
+    match = UNKNOWN_FIELD_RE.match(message) or SETTING_PATH_RE.search(message)
+    if match:
+        candidates.add(match.group(1))
+    
+    if code.startswith("invalid_settings_"):
+        for key in settings:
+            snake_key = "".join(f"_{c.lower()}" if c.isupper() else c for c in key)
+            if code == f"invalid_settings_{snake_key}":
+                candidates.add(key)
+    
+    keys = [key for key in candidates if key in settings]
+    return keys[0] if len(keys) == 1 else None
+
+def apply_settings(session, meilisearch_url, index_uid, settings, log):
+    """Apply settings to an index, leaving out the keys Meilisearch rejects.
+    
+    Everything is sent in one PATCH. If that fails, the key named by the
+    error is dropped, or when no key is named the settings are split in half
+    and each half is tried on its own, so a single bad key costs O(log N)
+    tasks instead of one per key. Returns the keys that could not be applied.
+    """
+    error = patch_settings(session, meilisearch_url, index_uid, settings, log)
+    if error is None:
+        return []
+    
+    if len(settings) == 1:
+        key = next(iter(settings))
+        log(f"Failed to apply setting {key} to index {index_uid}: {error}")
+        return [key]
+    
+    key = rejected_setting(error, settings)
+    if key:
+        log(f"Failed to apply setting {key} to index {index_uid}: {error}")
+        rest = {k: v for k, v in settings.items() if k != key}
+        return [key] + apply_settings(session, meilisearch_url, index_uid, rest, log)
+    
+    log(f"Failed to apply {len(settings)} settings to index {index_uid} at once: {error}")
+    keys = list(settings)
+    half = len(keys) // 2
+    failed = []
+    for part in (keys[:half], keys[half:]):
+        failed += apply_settings(session, meilisearch_url, index_uid, {k: settings[k] for k in part}, log)
+    return failed
+
+def finish_index_task(session, meilisearch_url, response, index_uid, action, log):
+    """Wait for an index "create" or "delete" task. Returns True if it succeeded.
+    
+    A create that fails because the index already exists counts as success,
+    since a connection error can make the same create reach the server twice.
+    """
+    noun, done = {"create": ("creation", "Created"), "delete": ("deletion", "Deleted")}[action]
+    if response.status_code not in (201, 200, 202):
+        log(f"Failed to {action} index {index_uid}: {response.text}")
+        return False
+    
+    task_id = _task_uid(response)
+    log(f"Index {noun} enqueued with task ID {task_id}, waiting for completion...")
+    task = wait_for_task(meilisearch_url, task_id, session)
+    if task and task['status'] == 'succeeded':
+        log(f"{done} index {index_uid}")
+        return True
+    if action == "create" and task and (task.get('error') or {}).get('code') == 'index_already_exists':
+        log(f"Index {index_uid} already exists")
+        return True
+    
+    log(f"Failed to {action} index {index_uid}: {task}")
+    return False
+
+def _restore_index(session, meilisearch_url, zip_ref, names, index_dir, existing_uids, log,
+                   batch_size=RESTORE_BATCH_SIZE, force_delete=False, force_primary_key=None,
+                   strip_embedders=False, inject_vectors_null=False):
+    """Restore one index from its directory in the backup zip.
+    
+    force_delete recreates the index even if it already exists.
+    force_primary_key is used when the backup records no primary key, is
+    copied from _meilisearch_id into documents that lack it, and is forced
+    onto the index if a batch fails on a primary key error. strip_embedders
+    drops the embedders setting and inject_vectors_null gives documents
+    without vectors a null default vector. Yields the log as the restore
+    progresses.
+    """
+    index_uid = index_dir.rsplit("/", 1)[-1]
+    log(f"Restoring index: {index_uid}")
+    yield log
+    
+    # The backup format version decides how the documents are read back;
+    # backups made before it was recorded are version 1
+    info_file = f"{index_dir}/info.json"
+    info = orjson.loads(zip_ref.read(info_file)) if info_file in names else {}
+    format_version = info.get("backupFormatVersion", 1)
+    
+    # Delete the existing index first if it must be recreated
+    exists = index_uid in existing_uids
+    if force_delete and exists:
+        log(f"Deleting existing index {index_uid}")
+        delete_response = session.delete(f"{meilisearch_url}/indexes/{index_uid}")
+        if not finish_index_task(session, meilisearch_url, delete_response, index_uid, "delete", log):
+            return
+        exists = False
+    
+    # Create index if it doesn't exist, with the primary key from the backup
+    if not exists:
+        primary_key = info.get("primaryKey") or force_primary_key
         
-        # Create a new index
         create_data = {"uid": index_uid}
         if primary_key:
             create_data["primaryKey"] = primary_key
         
-        log_output += f"Creating new index {index_uid} with primary key {primary_key}\n"
-        create_response = requests.post(
-            f"{meilisearch_url}/indexes",
-            headers=headers,
-            json=create_data
-        )
-        
-        if create_response.status_code in (201, 200, 202):
-            task_id = create_response.json().get('taskUid')
-            log_output += f"Index creation enqueued with task ID {task_id}, waiting for completion...\n"
-            
-            task = wait_for_task(meilisearch_url, task_id, headers)
-            if task and task['status'] == 'succeeded':
-                log_output += f"Created index {index_uid}\n"
-            else:
-                log_output += f"Failed to create index {index_uid}: {task}\n"
-                return log_output
-        else:
-            log_output += f"Failed to create index {index_uid}: {create_response.text}\n"
-            return log_output
-        
-        # Apply settings with vector search disabled
-        settings_file = documents_index_dir / "settings.json"
-        if settings_file.exists():
-            with open(settings_file, "r") as f:
-                settings = json.load(f)
+        log(f"Creating index {index_uid} with primary key {primary_key}")
+        create_response = session.post(f"{meilisearch_url}/indexes", data=orjson.dumps(create_data), headers=JSON_HEADERS)
+        if not finish_index_task(session, meilisearch_url, create_response, index_uid, "create", log):
+            return
+    else:
+        log(f"Index {index_uid} already exists")
+    
+    # Restore settings
+    settings_file = f"{index_dir}/settings.json"
+    if settings_file in names:
+        try:
+            settings = orjson.loads(zip_ref.read(settings_file))
             
             # Remove embedders configuration to disable vector search
-            if 'embedders' in settings:
-                log_output += "Removing embedders configuration\n"
+            if strip_embedders and 'embedders' in settings:
+                log("Removing embedders configuration")
                 del settings['embedders']
             
-            # Apply modified settings
-            settings_response = requests.patch(
-                f"{meilisearch_url}/indexes/{index_uid}/settings",
-                headers=headers,
-                json=settings
-            )
-            
-            if settings_response.status_code in (200, 202):
-                task_id = settings_response.json().get('taskUid')
-                log_output += f"Settings update enqueued with task ID {task_id}, waiting for completion...\n"
-                
-                task = wait_for_task(meilisearch_url, task_id, headers)
-                if task and task['status'] == 'succeeded':
-                    log_output += f"Applied settings to index {index_uid}\n"
-                else:
-                    log_output += f"Failed to apply settings to index {index_uid}: {task}\n"
+            # Apply all settings at once, narrowing down any rejected keys
+            failed = apply_settings(session, meilisearch_url, index_uid, settings, log)
+            if failed:
+                log(f"Applied settings to index {index_uid} except {', '.join(failed)}")
             else:
-                log_output += f"Failed to apply settings to index {index_uid}: {settings_response.text}\n"
-        
-        # Prepare documents for import
-        documents_file = documents_index_dir / "documents.json"
-        if documents_file.exists():
-            with open(documents_file, "r") as f:
-                documents = json.load(f)
-            
-            if documents:
-                # Add _vectors.default: null to each document
-                log_output += "Adding null vector embeddings to documents\n"
-                for doc in documents:
-                    if '_vectors' not in doc:
-                        doc['_vectors'] = {'default': None}
-                
-                # Add documents in batches
-                batch_size = 1000
-                for i in range(0, len(documents), batch_size):
-                    batch = documents[i:i + batch_size]
-                    log_output += f"Adding batch of {len(batch)} documents to index {index_uid} ({i+1}-{i+len(batch)} of {len(documents)})\n"
-                    
-                    docs_response = requests.post(
-                        f"{meilisearch_url}/indexes/{index_uid}/documents",
-                        headers=headers,
-                        json=batch
-                    )
-                    
-                    if docs_response.status_code in (202, 201, 200):
-                        task_id = docs_response.json().get('taskUid')
-                        log_output += f"Document addition enqueued with task ID {task_id}, waiting for completion...\n"
-                        
-                        task = wait_for_task(meilisearch_url, task_id, headers)
-                        if task and task['status'] == 'succeeded':
-                            log_output += f"Successfully added batch to index {index_uid}\n"
-                        else:
-                            log_output += f"Failed to add documents to index {index_uid}: {task}\n"
-                    else:
-                        log_output += f"Failed to add documents to index {index_uid}: {docs_response.text}\n"
-                    
-                    # Wait a bit to avoid overwhelming the server
-                    time.sleep(1)
-            else:
-                log_output += f"No documents found for index {index_uid}\n"
-        else:
-            log_output += f"Documents file not found for index {index_uid}\n"
-        
-        log_output += "Fix completed for documents index\n"
+                log(f"Applied all settings to index {index_uid}")
+        except Exception as e:
+            log(f"Error processing settings file: {str(e)}")
+    
+    # Restore documents
+    documents_file = find_documents_file(names, index_dir, format_version)
+    if not documents_file:
+        log(f"Documents file not found for index {index_uid}")
+        return
     
-    # Clean up the temporary directory
     try:
-        shutil.rmtree(temp_dir)
-        log_output += f"Cleaned up temporary directory: {temp_dir}\n"
+        # Stream documents from the backup in batches to keep memory bounded
+        batches = iter_document_batches(zip_ref, documents_file, batch_size, format_version)
+        
+        if force_primary_key:
+            log(f"Making sure documents of index {index_uid} have a '{force_primary_key}' field")
+            batches = with_primary_key(batches, force_primary_key)
+        
+        if inject_vectors_null:
+            log("Adding null vector embeddings to documents")
+            batches = with_null_vectors(batches)
+        
+        added_docs = yield from upload_document_batches(
+            session, meilisearch_url, index_uid, batches, log,
+            primary_key_fallback=force_primary_key
+        )
+        
+        if not added_docs:
+            log(f"No documents found for index {index_uid}")
     except Exception as e:
-        log_output += f"Error cleaning up temporary directory: {str(e)}\n"
+        log(f"Error processing documents file: {str(e)}")
+
+def restore_meilisearch(meilisearch_url, meilisearch_api_key, zip_file, batch_size=RESTORE_BATCH_SIZE):
+    """Restore Meilisearch indexes from a zip file.
+    
+    Documents are sent in batches of batch_size. Yields the log as the
+    restore progresses; its text is only joined by log.value() when the
+    caller actually shows it.
+    """
+    log = Log()
+    
+    # Ensure URL format is correct
+    if meilisearch_url.endswith('/'):
+        meilisearch_url = meilisearch_url[:-1]
+    
+    # Reuse the pooled session of this API key so connections stay warm
+    session = get_session(meilisearch_api_key)
+    
+    # Read the backup straight from the zip file, nothing is extracted to disk
+    log(f"Reading backup from {zip_file}")
+    with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+        yield from restore_from_zip(session, meilisearch_url, zip_ref, log, batch_size)
+
+def restore_from_zip(session, meilisearch_url, zip_ref, log, batch_size=RESTORE_BATCH_SIZE):
+    """Restore every index found in an open backup zip file.
+    
+    Member files are streamed from the zip as they are needed. Yields the
+    log as the restore progresses.
+    """
+    names = set(zip_ref.namelist())
+    
+    # Find the backup directory
+    backup_dir = None
+    for name in sorted(names):
+        top = name.split("/", 1)[0]
+        if "/" in name and "meilisearch_backup" in top:
+            backup_dir = top
+            break
+    
+    if not backup_dir:
+        log("Error: Could not find meilisearch_backup directory in the zip file.")
+        yield log
+        return
+    
+    # Get all index directories
+    index_uids = sorted({
+        name.split("/")[1] for name in names
+        if name.startswith(f"{backup_dir}/") and name.count("/") >= 2
+    })
+    log(f"Found {len(index_uids)} indexes to restore")
+    
+    # Look up which indexes already exist with a single listing
+    existing_indexes, error = list_indexes(session, meilisearch_url)
+    if error:
+        log(error)
+        yield log
+        return
+    existing_uids = {index["uid"] for index in existing_indexes}
+    
+    # Ordinary indexes first, then the specially handled ones in plan order
+    ordered_uids = [uid for uid in index_uids if uid not in RESTORE_PLAN]
+    ordered_uids += [uid for uid in RESTORE_PLAN if uid in index_uids]
+    
+    for index_uid in ordered_uids:
+        yield from _restore_index(
+            session, meilisearch_url, zip_ref, names, f"{backup_dir}/{index_uid}", existing_uids, log, batch_size,
+            **RESTORE_PLAN.get(index_uid, {})
+        )
     
-    log_output += "Restore process completed!\n"
-    return log_output
+    log("Restore process completed!")
+    yield log
 
 # Create Gradio interface
 def create_interface():
@@ -596,26 +957,31 @@ def create_interface():
         with gr.Tab("Backup"):
             backup_url = gr.Textbox(label="Meilisearch URL", placeholder="https://searchek.dev.eklavya.me")
             backup_key = gr.Textbox(label="Meilisearch API Key", placeholder="Your-API-Key", type="password")
+            backup_page_size = gr.Number(label="Max page size", value=PAGE_LIMIT, minimum=100, precision=0)
             backup_button = gr.Button("Backup")
             backup_output = gr.Textbox(label="Backup Logs", lines=20)
             backup_file = gr.File(label="Download Backup File")
             
-            def run_backup(url, key):
+            def run_backup(url, key, page_size):
                 if not url or not key:
-                    return None, "Please provide both Meilisearch URL and API Key"
+                    yield None, "Please provide both Meilisearch URL and API Key"
+                    return
                 
+                zip_path, log = None, None
+                last_update = 0.0
                 try:
-                    zip_path, log_output = backup_meilisearch(url, key)
-                    if zip_path:
-                        return zip_path, log_output
-                    else:
-                        return None, log_output
+                    for zip_path, log in backup_meilisearch(url, key, int(page_size or PAGE_LIMIT)):
+                        # The whole log is sent on every update, so only join and send a few per second
+                        if time.monotonic() - last_update >= PROGRESS_INTERVAL:
+                            last_update = time.monotonic()
+                            yield zip_path, log.value()
+                    yield zip_path, log.value() if log else ""
                 except Exception as e:
-                    return None, f"Error during backup: {str(e)}"
+                    yield None, f"{log.value() if log else ''}Error during backup: {str(e)}"
             
             backup_button.click(
                 run_backup, 
-                inputs=[backup_url, backup_key], 
+                inputs=[backup_url, backup_key, backup_page_size], 
                 outputs=[backup_file, backup_output]
             )
         
@@ -623,22 +989,30 @@ def create_interface():
             restore_url = gr.Textbox(label="Meilisearch URL", placeholder="https://searchek.dev.eklavya.me")
             restore_key = gr.Textbox(label="Meilisearch API Key", placeholder="Your-API-Key", type="password")
             restore_file = gr.File(label="Upload Backup File")
+            restore_batch_size = gr.Number(label="Batch size", value=RESTORE_BATCH_SIZE, minimum=1, precision=0)
             restore_button = gr.Button("Restore")
             restore_output = gr.Textbox(label="Restore Logs", lines=20)
             
-            def run_restore(url, key, file):
+            def run_restore(url, key, file, batch_size):
                 if not url or not key or not file:
-                    return "Please provide Meilisearch URL, API Key, and a backup zip file"
+                    yield "Please provide Meilisearch URL, API Key, and a backup zip file"
+                    return
                 
+                log = None
+                last_update = 0.0
                 try:
-                    log_output = restore_meilisearch(url, key, file.name)
-                    return log_output
+                    for log in restore_meilisearch(url, key, file.name, int(batch_size or RESTORE_BATCH_SIZE)):
+                        # The whole log is sent on every update, so only join and send a few per second
+                        if time.monotonic() - last_update >= PROGRESS_INTERVAL:
+                            last_update = time.monotonic()
+                            yield log.value()
+                    yield log.value() if log else ""
                 except Exception as e:
-                    return f"Error during restore: {str(e)}"
+                    yield f"{log.value() if log else ''}Error during restore: {str(e)}"
             
             restore_button.click(
                 run_restore, 
-                inputs=[restore_url, restore_key, restore_file], 
+                inputs=[restore_url, restore_key, restore_file, restore_batch_size], 
                 outputs=[restore_output]
             )
     
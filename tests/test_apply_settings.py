@@ -0,0 +1,75 @@
+import app
+
+# Settings keys accepted by Meilisearch, in the order its error message lists them
+KNOWN_KEYS = [
+    "displayedAttributes", "searchableAttributes", "filterableAttributes", "sortableAttributes",
+    "rankingRules", "stopWords", "nonSeparatorTokens", "separatorTokens", "dictionary", "synonyms",
+    "distinctAttribute", "proximityPrecision", "typoTolerance", "faceting", "pagination",
+    "embedders", "searchCutoffMs", "localizedAttributes",
+]
+
+
+def unknown_field_error(key):
+    expected = ", ".join(f"`{k}`" for k in KNOWN_KEYS)
+    return {
+        "message": f"Unknown field `{key}`: expected one of {expected}",
+        "code": "bad_request",
+        "type": "invalid_request",
+        "link": "https://docs.meilisearch.com/errors#bad_request",
+    }
+
+
+def fake_meilisearch(monkeypatch):
+    """Reject the first unknown key of a PATCH like Meilisearch does, apply the rest."""
+    applied = {}
+    requests = []
+
+    def patch_settings(session, meilisearch_url, index_uid, settings, log):
+        requests.append(list(settings))
+        for key in settings:
+            if key not in KNOWN_KEYS:
+                return unknown_field_error(key)
+        applied.update(settings)
+        return None
+
+    monkeypatch.setattr(app, "patch_settings", patch_settings)
+    return applied, requests
+
+
+def test_unknown_field_drops_only_the_unknown_keys(monkeypatch):
+    applied, requests = fake_meilisearch(monkeypatch)
+    settings = {key: [] for key in KNOWN_KEYS[:11]}
+    settings["facetSearch"] = True
+    settings["prefixSearch"] = "indexingTime"
+
+    failed = app.apply_settings(None, "http://meili", "books", settings, app.Log())
+
+    assert sorted(failed) == ["facetSearch", "prefixSearch"]
+    assert applied == {key: [] for key in KNOWN_KEYS[:11]}
+    assert len(requests) == 3
+
+
+def test_rejected_setting_ignores_the_expected_keys():
+    settings = {"displayedAttributes": ["*"], "facetSearch": True}
+    assert app.rejected_setting(unknown_field_error("facetSearch"), settings) == "facetSearch"
+    assert app.rejected_setting(unknown_field_error("prefixSearch"), settings) is None
+
+
+def test_rejected_setting_reads_the_path_and_code():
+    settings = {"filterableAttributes": "price", "typoTolerance": {"enabled": "yes"}}
+    path_error = {
+        "message": "Invalid value type at `.typoTolerance.enabled`: expected a boolean, but found a string: `\"yes\"`",
+        "code": "invalid_settings_typo_tolerance",
+    }
+    code_error = {"message": "Invalid value type: expected an array", "code": "invalid_settings_filterable_attributes"}
+    assert app.rejected_setting(path_error, settings) == "typoTolerance"
+    assert app.rejected_setting(code_error, settings) == "filterableAttributes"
+
+
+def test_rejected_setting_is_none_when_ambiguous():
+    settings = {"filterableAttributes": "price", "sortableAttributes": "price"}
+    error = {
+        "message": "Invalid value type at `.filterableAttributes`: expected an array",
+        "code": "invalid_settings_sortable_attributes",
+    }
+    assert app.rejected_setting(error, settings) is None
@@ -0,0 +1,59 @@
+import zipfile
+
+import orjson
+import zstandard as zstd
+
+import app
+
+DOCS = [{"id": i, "title": f"Bök ✓ {i}", "price": i / 3, "text": "line\nbreak ] }"} for i in range(1234)]
+
+
+def write_backup(path, format_version):
+    """Write a one-index backup zip in the given backup format version."""
+    with zipfile.ZipFile(path, "w") as zipf:
+        info = {"uid": "books", "primaryKey": "id"}
+        if format_version >= 2:
+            info["backupFormatVersion"] = format_version
+            pages = [DOCS[offset:offset + 500] for offset in range(0, len(DOCS), 500)]
+            lines = b"".join(orjson.dumps(page, option=orjson.OPT_APPEND_NEWLINE) for page in pages)
+            zipf.writestr("meilisearch_backup/books/documents.ndjson.zst", zstd.ZstdCompressor().compress(lines))
+        else:
+            zipf.writestr("meilisearch_backup/books/documents.json", orjson.dumps(DOCS, option=orjson.OPT_INDENT_2))
+        zipf.writestr("meilisearch_backup/books/info.json", orjson.dumps(info))
+
+
+def read_batches(path, format_version, batch_size=300):
+    with zipfile.ZipFile(path) as zip_ref:
+        names = set(zip_ref.namelist())
+        documents_file = app.find_documents_file(names, "meilisearch_backup/books", format_version)
+        return documents_file, list(app.iter_document_batches(zip_ref, documents_file, batch_size, format_version))
+
+
+def test_restores_version_1_documents_json(tmp_path):
+    path = tmp_path / "backup.zip"
+    write_backup(path, 1)
+
+    documents_file, batches = read_batches(path, 1)
+
+    assert documents_file == "meilisearch_backup/books/documents.json"
+    assert [len(batch) for batch in batches] == [300, 300, 300, 300, 34]
+    assert [doc for batch in batches for doc in batch] == DOCS
+
+
+def test_restores_version_2_ndjson_zst(tmp_path):
+    path = tmp_path / "backup.zip"
+    write_backup(path, 2)
+
+    documents_file, batches = read_batches(path, 2)
+
+    assert documents_file == "meilisearch_backup/books/documents.ndjson.zst"
+    assert [len(batch) for batch in batches] == [300, 300, 300, 300, 34]
+    assert [doc for batch in batches for doc in batch] == DOCS
+
+
+def test_version_decides_the_documents_file(tmp_path):
+    path = tmp_path / "backup.zip"
+    write_backup(path, 2)
+
+    with zipfile.ZipFile(path) as zip_ref:
+        assert app.find_documents_file(set(zip_ref.namelist()), "meilisearch_backup/books", 1) is None
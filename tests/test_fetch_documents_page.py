@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+
+import orjson
+import requests
+
+import app
+
+DOCS = [{"id": i, "title": f"Bök ✓ {i}", "text": "line\nbreak ] } , \"q\"", "tags": [{"a": i}]} for i in range(300)]
+
+
+def response(status_code, content):
+    return SimpleNamespace(status_code=status_code, content=content, text=content.decode())
+
+
+class Meilisearch:
+    """Serve pages of DOCS the way GET /indexes/{uid}/documents does."""
+
+    def __init__(self, render=None, refuse_above=None, timeout_above=None):
+        self.render = render or (lambda page: orjson.dumps(page))
+        self.refuse_above = refuse_above
+        self.timeout_above = timeout_above
+        self.limits = []
+
+    def get(self, url, params, timeout):
+        offset, limit = params["offset"], params["limit"]
+        self.limits.append(limit)
+        if self.timeout_above and limit > self.timeout_above:
+            raise requests.exceptions.ReadTimeout("read timed out")
+        if self.refuse_above and limit > self.refuse_above:
+            return response(413, b'{"message":"payload too large"}')
+        page = {"results": DOCS[offset:offset + limit], "offset": offset, "limit": limit, "total": len(DOCS)}
+        return response(200, self.render(page))
+
+
+def fetch(session, offset=0, limit=100):
+    return app.fetch_documents_page(session, "http://meili", "books", offset, limit)
+
+
+def test_fast_path_copies_the_results_array():
+    session = Meilisearch()
+    documents, count, error = fetch(session, offset=250, limit=100)
+
+    body = orjson.dumps({"results": DOCS[250:], "offset": 250, "limit": 100, "total": len(DOCS)})
+    assert error is None
+    assert documents == body[len(b'{"results":'):body.rfind(b"]") + 1] + b"\n"
+    assert count == 50
+    assert orjson.loads(documents) == DOCS[250:]
+
+
+def test_bare_list_falls_back_to_decoding():
+    session = Meilisearch(render=lambda page: orjson.dumps(page["results"]))
+    documents, count, error = fetch(session, limit=100)
+
+    assert error is None
+    assert count == 100
+    assert documents.count(b"\n") == 1
+    assert orjson.loads(documents) == DOCS[:100]
+
+
+def test_other_key_order_falls_back_to_decoding():
+    def render(page):
+        return orjson.dumps({"offset": page["offset"], "limit": page["limit"], "total": page["total"],
+                             "results": page["results"]})
+
+    documents, count, error = fetch(Meilisearch(render=render), offset=100, limit=100)
+
+    assert error is None
+    assert count == 100
+    assert documents.count(b"\n") == 1
+    assert orjson.loads(documents) == DOCS[100:200]
+
+
+def test_count_disagreeing_with_an_empty_array_falls_back_to_decoding():
+    def render(page):
+        return orjson.dumps({"results": [], "offset": page["offset"], "limit": page["limit"], "total": page["total"]})
+
+    documents, count, error = fetch(Meilisearch(render=render), limit=100)
+
+    assert (documents, count, error) == (b"[]\n", 0, None)
+
+
+def test_refused_page_is_fetched_as_two_lines():
+    session = Meilisearch(refuse_above=150)
+    documents, count, error = fetch(session, limit=300)
+
+    assert error is None
+    assert count == 300
+    assert session.limits == [300, 150, 150]
+    lines = documents.splitlines()
+    assert [orjson.loads(line) for line in lines] == [DOCS[:150], DOCS[150:]]
+
+
+def test_timed_out_page_is_split_but_not_below_min_page_limit():
+    session = Meilisearch(timeout_above=100)
+    documents, count, error = fetch(session, limit=300)
+
+    assert session.limits == [300, 150]
+    assert documents is None and count == 0
+    assert "limit 150" in error